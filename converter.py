@@ -1,24 +1,46 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
+import io
 import os
 import re
+
+# Doit être posé AVANT l'import de torch (via marker): segments extensibles
+# et GC de l'allocateur CUDA pour limiter la fragmentation due aux PDFs de
+# tailles très variables (sinon le converter se fait réinitialiser trop tôt)
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF",
+    "expandable_segments:True,garbage_collection_threshold:0.8"
+)
+
 from marker.converters.pdf import PdfConverter
 from marker.models import create_model_dict
 from marker.output import text_from_rendered
 from marker.config.parser import ConfigParser
 import torch
+
+try:
+    import fitz  # PyMuPDF: extraction directe des PDFs avec couche texte
+except ImportError:
+    fitz = None
 import time
 import logging
 from datetime import datetime, timedelta
-from ftplib import FTP
+from ftplib import FTP, error_perm
 import psutil
 import gc
-import subprocess
+import hashlib
+import shutil
 import json
 import sys
 import fcntl
 import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 from urllib.parse import unquote
 
 
@@ -55,6 +77,7 @@ FTP_DIR = "/markdown"
 FAILED_PDF_LOG = "failed_pdfs.json"
 PROCESSED_PDF_LOG = "processed_pdfs.json"
 REMOVED_PDF_LOG = "removed_pdfs.json"  # Nouveau: tracking des PDFs supprimés
+HTTP_CACHE_FILE = "http_cache.json"  # ETag / Last-Modified par URL (GET conditionnel)
 CHATBOT_ID = os.getenv("CHATBOT_ID")
 BEARER_TOKEN = os.getenv("BEARER_TOKEN")
 BASE_URL = os.getenv("BASE_URL")
@@ -64,16 +87,66 @@ LOCK_FILE = "/tmp/converter.lock"
 HTTP_TIMEOUT = 60
 FTP_TIMEOUT = 120
 
+# Nombre de workers pour le traitement parallèle des PDFs
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "2"))
+
+# Forcer l'inférence CPU uniquement sur demande explicite (debug, GPU instable);
+# par défaut Marker utilise le GPU s'il est disponible
+if os.getenv("FORCE_CPU", "0") == "1":
+    torch.cuda.is_available = lambda: False
+
+# Instrumentation mémoire optionnelle (DEBUG_MEM=1): alerte sur les tenseurs
+# libérés uniquement par le collecteur de cycles + historique des allocations
+# CUDA, avec snapshot dumpé quand la RAM passe le seuil d'alerte
+DEBUG_MEM = os.getenv("DEBUG_MEM", "0") == "1"
+if DEBUG_MEM:
+    try:
+        from torch.utils.viz._cycles import warn_tensor_cycles
+        warn_tensor_cycles()
+    except ImportError:
+        logging.warning("warn_tensor_cycles indisponible dans cette version de torch")
+    if torch.cuda.is_available():
+        torch.cuda.memory._record_memory_history()
+
 HEADERS = {
     "Authorization": f"Bearer {BEARER_TOKEN}",
     "Accept": "application/json",
     "Content-Type": "application/json"
 }
 
+# Session HTTP partagée: keep-alive + pool de connexions réutilisables
+# entre les threads (évite un handshake TCP/TLS par requête)
+SESSION = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    # Throttling adaptatif: on ne ralentit que si le serveur le demande
+    # (429/5xx), en respectant son en-tête Retry-After
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True
+    )
+)
+SESSION.mount("https://", _http_adapter)
+SESSION.mount("http://", _http_adapter)
+
 # Variable globale pour le converter (réutilisation)
 _converter = None
 _lock_fd = None
 
+# Locks pour le traitement parallèle: la conversion Marker est sérialisée
+# (un seul converter partagé), les écritures des JSON de tracking aussi
+_convert_lock = threading.Lock()
+_tracking_lock = threading.Lock()
+
+# Pool dédié au post-traitement (upload FTP + source chatbot), pour que les
+# workers enchaînent sur le PDF suivant sans attendre le réseau. Le sémaphore
+# borne les tâches en attente (backpressure, limite la RAM/disque utilisés)
+_post_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="post")
+_post_slots = threading.BoundedSemaphore(4)
+
 
 # ============================================
 # GESTION DU LOCK (éviter exécutions concurrentes)
@@ -112,19 +185,45 @@ def release_lock():
 # UTILITAIRES
 # ============================================
 
+# Compilé une seule fois: get_clean_filename est appelé plusieurs fois par PDF
+_WPDM_RE = re.compile(r"^\d+wpdm_")
+
+
+@functools.lru_cache(maxsize=4096)
 def get_clean_filename(url):
-    """Extrait et nettoie le nom de fichier depuis l'URL (fonction centralisée)"""
-    raw_filename = url.split("&ind=")[-1]
+    """Extrait et nettoie le nom de fichier depuis l'URL (fonction centralisée,
+    mémoïsée: appelée plusieurs fois par PDF avec la même URL)"""
+    raw_filename = url.rpartition("&ind=")[2]
     # Decode URL encoding si présent
     raw_filename = unquote(raw_filename)
     # Supprime le préfixe numérique wpdm_ si présent
-    return re.sub(r"^\d+wpdm_", "", raw_filename)
+    return _WPDM_RE.sub("", raw_filename)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_clean_title(pdf_url):
+    """Retourne le titre lisible (sans tirets ni extension) pour un PDF donné"""
+    return get_clean_filename(pdf_url).replace("-", " ").replace(".pdf", "")
 
 
 def get_markdown_filename(pdf_url):
-    """Retourne le nom du fichier markdown pour un PDF donné"""
+    """Retourne le nom du fichier markdown pour un PDF donné.
+
+    Seul le suffixe final est remplacé: un '.pdf' au milieu du nom
+    (ex: 'rapport.pdf.v2.pdf') n'est pas touché."""
     clean_filename = get_clean_filename(pdf_url)
-    return clean_filename.replace(".pdf", ".md")
+    if clean_filename.lower().endswith(".pdf"):
+        clean_filename = clean_filename[:-4]
+    return clean_filename + ".md"
+
+
+def compute_pdf_hash(pdf_path):
+    """Calcule le SHA-256 d'un fichier par blocs de 1 MiB"""
+    sha = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
 
 
 def get_markdown_path(pdf_url):
@@ -133,30 +232,42 @@ def get_markdown_path(pdf_url):
 
 
 def suspendInstance():
-    """Suspend l'instance OVH"""
+    """Suspend l'instance OVH (appel direct, sans sous-processus)"""
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            result = subprocess.run(
-                ["python", "suspendInstance.py"], 
-                check=True, 
-                capture_output=True, 
-                text=True,
-                timeout=60
-            )
-            logging.info(f"Script suspendInstance exécuté avec succès : {result.stdout}")
+            # Import paresseux: le SDK openstack n'est chargé qu'au moment
+            # de la suspension, jamais pendant le traitement des PDFs
+            from suspendInstance import suspend
+            suspend()
+            logging.info("Instance suspendue avec succès")
             return
-        except subprocess.TimeoutExpired:
-            logging.error(f"Timeout lors de l'exécution de suspendInstance.py (tentative {attempt + 1}/{max_retries})")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Erreur lors de l'exécution de suspendInstance.py (tentative {attempt + 1}/{max_retries}): {e.stderr}")
-        
+        except Exception as e:
+            logging.error(f"Erreur lors de la suspension de l'instance (tentative {attempt + 1}/{max_retries}): {e}")
+
         if attempt < max_retries - 1:
             time.sleep(10)
-    
+
     logging.critical("Impossible de suspendre l'instance après plusieurs tentatives")
 
 
+# Limitation des uploads de logs.log: une alerte mémoire par PDF peut sinon
+# déclencher une rafale d'uploads identiques
+_last_log_upload = 0.0
+LOG_UPLOAD_MIN_INTERVAL = 60  # secondes
+
+
+def upload_logs_throttled():
+    """Upload logs.log au plus une fois par minute"""
+    global _last_log_upload
+    now = time.time()
+    if now - _last_log_upload < LOG_UPLOAD_MIN_INTERVAL:
+        logging.debug("Upload logs.log ignoré (throttling)")
+        return
+    _last_log_upload = now
+    upload_to_ftp("logs.log")
+
+
 def check_memory_usage():
     """Vérifie l'utilisation mémoire et alerte si critique"""
     mem = psutil.virtual_memory()
@@ -169,30 +280,62 @@ def check_memory_usage():
     
     if mem.percent > 85:
         logging.warning("⚠️ ALERTE: Mémoire RAM très haute (>85%) - risque d'arrêt!")
+        if DEBUG_MEM and torch.cuda.is_available():
+            try:
+                torch.cuda.memory._dump_snapshot("cuda_snapshot.pickle")
+                logging.info("Snapshot allocateur CUDA écrit: cuda_snapshot.pickle")
+            except Exception as e:
+                logging.warning(f"Impossible d'écrire le snapshot CUDA: {e}")
         # Tenter de libérer de la mémoire
         gc.collect()
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        upload_to_ftp("logs.log")
+        upload_logs_throttled()
         return False
     
     return True
 
 
+# Au-delà de ce volume de mémoire réservée mais non allouée (fragmentation),
+# on rend les caches de l'allocateur au driver
+GPU_FRAGMENTATION_THRESHOLD = 1 << 30  # 1 GB
+
+# Collecte complète des cycles de références (génération 2) tous les N PDFs:
+# assez rare pour ne pas peser, assez fréquent pour casser les cycles
+# retenant des tenseurs entre deux alertes mémoire
+GC_FULL_EVERY = 20
+_cleanup_calls = 0
+
+
 def cleanup_gpu_memory():
-    """Nettoie la mémoire GPU de manière agressive"""
-    global _converter
-    
+    """Nettoie la mémoire GPU quand c'est réellement nécessaire.
+
+    empty_cache() force une barrière de synchronisation et un aller-retour
+    driver: l'appeler à chaque PDF ralentit le pipeline alors que
+    l'allocateur PyTorch réutilise sa mémoire tout seul. On ne le déclenche
+    que si la fragmentation (réservé - alloué) dépasse le seuil."""
+    global _converter, _cleanup_calls
+
+    _cleanup_calls += 1
+
     if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-        torch.cuda.synchronize()
-    
-    gc.collect()
-    
-    # Réinitialiser le converter si la mémoire est trop utilisée
+        fragmentation = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        if fragmentation > GPU_FRAGMENTATION_THRESHOLD:
+            logging.info(f"Fragmentation GPU {fragmentation / 1024**3:.2f}GB, vidage du cache allocateur")
+            torch.cuda.empty_cache()
+
+    # Un gc.collect() complet par PDF est du CPU perdu: ne collecter que
+    # quand la RAM commence réellement à se tendre, plus une collecte
+    # complète périodique pour casser les cycles retenant des tenseurs
+    if psutil.virtual_memory().percent > 75 or _cleanup_calls % GC_FULL_EVERY == 0:
+        gc.collect()
+
+    # Filet de sécurité en dernier recours: avec expandable_segments et le
+    # garbage_collection_threshold de l'allocateur (cf. PYTORCH_CUDA_ALLOC_CONF
+    # en tête de fichier), ce seuil ne devrait plus se déclencher en usage normal
     if torch.cuda.is_available():
         mem_allocated = torch.cuda.memory_allocated() / 1024**3
-        if mem_allocated > 2.0:  # Plus de 2GB utilisés
+        if mem_allocated > 4.0:  # Plus de 4GB utilisés
             logging.warning(f"Mémoire GPU élevée ({mem_allocated:.2f}GB), réinitialisation du converter")
             _converter = None
             gc.collect()
@@ -203,54 +346,156 @@ def cleanup_gpu_memory():
 # FONCTIONS FTP
 # ============================================
 
-def upload_to_ftp(file_path, max_retries=3):
-    """Upload un fichier vers le serveur FTP avec retry"""
-    if not os.path.exists(file_path):
+# Connexions FTP persistantes: une par thread (ftplib n'est pas thread-safe),
+# réutilisées entre les opérations au lieu de se reconnecter à chaque fichier
+_ftp_local = threading.local()
+_ftp_connections = []
+_ftp_connections_lock = threading.Lock()
+
+
+def _close_ftp(ftp):
+    """Ferme une connexion FTP sans lever d'erreur"""
+    try:
+        ftp.quit()
+    except Exception:
+        try:
+            ftp.close()
+        except Exception:
+            pass
+    with _ftp_connections_lock:
+        if ftp in _ftp_connections:
+            _ftp_connections.remove(ftp)
+
+
+def _reset_ftp():
+    """Invalide la connexion FTP du thread courant (reconnexion au prochain appel)"""
+    ftp = getattr(_ftp_local, "ftp", None)
+    if ftp is not None:
+        _close_ftp(ftp)
+        _ftp_local.ftp = None
+
+
+def get_ftp():
+    """Retourne la connexion FTP persistante du thread courant (lazy).
+
+    Le canal de contrôle est réutilisé entre les opérations; un NOOP vérifie
+    qu'il est encore vivant, sinon on reconnecte.
+    """
+    ftp = getattr(_ftp_local, "ftp", None)
+    if ftp is not None:
+        try:
+            ftp.voidcmd("NOOP")
+            return ftp
+        except Exception:
+            logging.info("Connexion FTP perdue, reconnexion...")
+            _close_ftp(ftp)
+            _ftp_local.ftp = None
+
+    ftp = FTP(FTP_HOST, timeout=FTP_TIMEOUT)
+    ftp.login(FTP_USER, FTP_PASS)
+    ftp.cwd(FTP_DIR)
+    _ftp_local.ftp = ftp
+    with _ftp_connections_lock:
+        _ftp_connections.append(ftp)
+    return ftp
+
+
+def close_all_ftp():
+    """Ferme toutes les connexions FTP persistantes (fin de run)"""
+    with _ftp_connections_lock:
+        connections = list(_ftp_connections)
+    for ftp in connections:
+        _close_ftp(ftp)
+
+
+atexit.register(close_all_ftp)
+
+
+def _store_via_sendfile(ftp, file_path):
+    """Upload zéro-copie via os.sendfile: les octets vont du cache de pages
+    au socket sans repasser par un buffer Python (Linux uniquement)"""
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        ftp.voidcmd("TYPE I")
+        conn = ftp.transfercmd(f"STOR {os.path.basename(file_path)}")
+        try:
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(conn.fileno(), f.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        finally:
+            conn.close()
+        ftp.voidresp()
+
+
+def upload_to_ftp(file_path, max_retries=3, data=None):
+    """Upload un fichier vers le serveur FTP avec retry.
+
+    data permet de fournir le contenu déjà en mémoire (bytes): le fichier
+    n'est alors pas relu depuis le disque."""
+    if data is None and not os.path.exists(file_path):
         logging.warning(f"Fichier inexistant, upload ignoré: {file_path}")
         return False
-    
+
     for attempt in range(max_retries):
         try:
-            with FTP(FTP_HOST, timeout=FTP_TIMEOUT) as ftp:
-                ftp.login(FTP_USER, FTP_PASS)
-                ftp.cwd(FTP_DIR)
+            ftp = get_ftp()
+            if data is not None:
+                ftp.storbinary(f"STOR {os.path.basename(file_path)}", io.BytesIO(data), blocksize=1 << 20)
+            elif hasattr(os, "sendfile"):
+                _store_via_sendfile(ftp, file_path)
+            else:
                 with open(file_path, "rb") as f:
-                    ftp.storbinary(f"STOR {os.path.basename(file_path)}", f)
-                logging.info(f"Upload FTP réussi : {file_path} -> {FTP_DIR}")
-                return True
+                    ftp.storbinary(f"STOR {os.path.basename(file_path)}", f, blocksize=1 << 20)
+            logging.info(f"Upload FTP réussi : {file_path} -> {FTP_DIR}")
+            return True
         except Exception as e:
             logging.error(f"Échec upload FTP (tentative {attempt + 1}/{max_retries}): {e}")
+            _reset_ftp()
             if attempt < max_retries - 1:
                 time.sleep(5)
-    
+
     logging.error(f"Upload FTP définitivement échoué pour {file_path}")
     return False
 
 
+def upload_many_to_ftp(paths):
+    """Upload une liste de fichiers en réutilisant la même connexion FTP
+    persistante (les fichiers absents sont ignorés)"""
+    for path in paths:
+        if os.path.exists(path):
+            upload_to_ftp(path)
+
+
 def delete_from_ftp(filename, max_retries=3):
-    """Supprime un fichier du serveur FTP avec retry"""
+    """Supprime un fichier du serveur FTP avec retry.
+
+    Pas de vérification d'existence préalable: un DELE sur un fichier
+    absent renvoie une erreur 550, traitée comme un succès."""
     for attempt in range(max_retries):
         try:
-            with FTP(FTP_HOST, timeout=FTP_TIMEOUT) as ftp:
-                ftp.login(FTP_USER, FTP_PASS)
-                ftp.cwd(FTP_DIR)
-                
-                # Vérifier si le fichier existe
-                file_list = ftp.nlst()
-                if filename not in file_list:
-                    logging.info(f"Fichier FTP déjà absent: {filename}")
-                    return True
-                
-                # Supprimer le fichier
-                ftp.delete(filename)
-                logging.info(f"Fichier FTP supprimé: {filename}")
+            ftp = get_ftp()
+            ftp.delete(filename)
+            logging.info(f"Fichier FTP supprimé: {filename}")
+            return True
+
+        except error_perm as e:
+            if str(e).startswith("550"):
+                logging.info(f"Fichier FTP déjà absent: {filename}")
                 return True
-                
+            logging.error(f"Échec suppression FTP (tentative {attempt + 1}/{max_retries}): {e}")
+            _reset_ftp()
+            if attempt < max_retries - 1:
+                time.sleep(5)
+
         except Exception as e:
             logging.error(f"Échec suppression FTP (tentative {attempt + 1}/{max_retries}): {e}")
+            _reset_ftp()
             if attempt < max_retries - 1:
                 time.sleep(5)
-    
+
     logging.error(f"Suppression FTP définitivement échouée pour {filename}")
     return False
 
@@ -258,12 +503,10 @@ def delete_from_ftp(filename, max_retries=3):
 def list_ftp_files():
     """Liste tous les fichiers sur le serveur FTP"""
     try:
-        with FTP(FTP_HOST, timeout=FTP_TIMEOUT) as ftp:
-            ftp.login(FTP_USER, FTP_PASS)
-            ftp.cwd(FTP_DIR)
-            return ftp.nlst()
+        return get_ftp().nlst()
     except Exception as e:
         logging.error(f"Erreur lors du listing FTP: {e}")
+        _reset_ftp()
         return []
 
 
@@ -271,16 +514,29 @@ def list_ftp_files():
 # FONCTIONS CHATBOT API
 # ============================================
 
-def get_sources():
-    """Récupère toutes les sources du chatbot"""
+# Cache de la liste des sources du chatbot: évite un GET complet (liste qui
+# grossit avec le temps) pour chaque PDF traité
+_sources_cache = None
+_sources_lock = threading.Lock()
+
+
+def get_sources(force_refresh=False):
+    """Récupère toutes les sources du chatbot (avec cache entre les PDFs)"""
+    global _sources_cache
+    with _sources_lock:
+        if _sources_cache is not None and not force_refresh:
+            return _sources_cache
     try:
-        response = requests.get(
-            f"{BASE_URL}/chatbot/{CHATBOT_ID}/sources", 
+        response = SESSION.get(
+            f"{BASE_URL}/chatbot/{CHATBOT_ID}/sources",
             headers=HEADERS,
             timeout=HTTP_TIMEOUT
         )
         if response.status_code == 200:
-            return response.json()
+            sources = response.json()
+            with _sources_lock:
+                _sources_cache = sources
+            return sources
         logging.error(f"Erreur API sources {response.status_code}: {response.text}")
     except requests.exceptions.Timeout:
         logging.error("Timeout lors de la récupération des sources")
@@ -305,12 +561,17 @@ def find_sources_by_wpdmdl(sources, wpdmdl_id):
 def delete_source(source_id):
     """Supprime une source spécifique"""
     try:
-        response = requests.delete(
-            f"{BASE_URL}/sources/{source_id}", 
+        response = SESSION.delete(
+            f"{BASE_URL}/sources/{source_id}",
             headers=HEADERS,
             timeout=HTTP_TIMEOUT
         )
         if response.status_code in [200, 204, 404]:
+            # Répercuter la suppression dans le cache local
+            global _sources_cache
+            with _sources_lock:
+                if _sources_cache is not None:
+                    _sources_cache = [s for s in _sources_cache if s.get("id") != source_id]
             logging.info(f"Source supprimée ou introuvable : {source_id}")
             return True
         logging.error(f"Erreur suppression source {response.status_code}: {response.text}")
@@ -322,19 +583,20 @@ def delete_source(source_id):
 def read_markdown_content(pdf_url):
     """Lit le contenu du fichier markdown correspondant au PDF"""
     md_path = get_markdown_path(pdf_url)
-    
-    if os.path.exists(md_path):
-        try:
-            with open(md_path, "r", encoding="utf-8") as file:
-                content = file.read()
-                if content.strip():
-                    return content
-                logging.warning(f"Fichier Markdown vide: {md_path}")
-        except Exception as e:
-            logging.error(f"Erreur lecture Markdown {md_path}: {e}")
-    else:
+
+    # EAFP: une seule ouverture, pas de stat préalable (et pas de race si le
+    # fichier bouge entre les deux)
+    try:
+        with open(md_path, "r", encoding="utf-8") as file:
+            content = file.read()
+        if content.strip():
+            return content
+        logging.warning(f"Fichier Markdown vide: {md_path}")
+    except FileNotFoundError:
         logging.warning(f"Fichier Markdown introuvable: {md_path}")
-    
+    except Exception as e:
+        logging.error(f"Erreur lecture Markdown {md_path}: {e}")
+
     return ""
 
 
@@ -342,14 +604,19 @@ def create_source(url, markdown_content):
     """Ajoute une nouvelle source avec l'URL et le contenu Markdown"""
     try:
         payload = {"url": url, "content": markdown_content}
-        response = requests.post(
-            f"{BASE_URL}/chatbot/{CHATBOT_ID}/sources", 
-            headers=HEADERS, 
+        response = SESSION.post(
+            f"{BASE_URL}/chatbot/{CHATBOT_ID}/sources",
+            headers=HEADERS,
             json=payload,
             timeout=HTTP_TIMEOUT
         )
         
         if response.status_code in [200, 201]:
+            # L'id de la nouvelle source est inconnu: invalider le cache,
+            # la vérification qui suit le repeuplera avec un état frais
+            global _sources_cache
+            with _sources_lock:
+                _sources_cache = None
             logging.info(f"Source ajoutée : {url}")
             return True
         logging.error(f"Erreur création source {response.status_code}: {response.text}")
@@ -358,16 +625,19 @@ def create_source(url, markdown_content):
     return False
 
 
-def verify_source_added(wpdmdl_id, max_retries=3):
-    """Vérifie que la nouvelle source a bien été ajoutée (match par wpdmdl)"""
-    for attempt in range(max_retries):
-        time.sleep(2)  # Attendre que l'API se synchronise
-        sources = get_sources()
+def verify_source_added(wpdmdl_id, delays=(0.5, 1.0, 2.0)):
+    """Vérifie que la nouvelle source a bien été ajoutée (match par wpdmdl).
+
+    Backoff exponentiel: la plupart des ajouts sont visibles très vite,
+    autant ne pas payer 2s de sommeil fixe à chaque PDF."""
+    for attempt, delay in enumerate(delays):
+        time.sleep(delay)  # Attendre que l'API se synchronise
+        sources = get_sources(force_refresh=True)
         if sources and find_sources_by_wpdmdl(sources, wpdmdl_id):
             logging.info("Vérification réussie : la source est bien présente")
             return True
-        if attempt < max_retries - 1:
-            logging.info(f"Vérification en cours... (tentative {attempt + 2}/{max_retries})")
+        if attempt < len(delays) - 1:
+            logging.info(f"Vérification en cours... (tentative {attempt + 2}/{len(delays)})")
 
     logging.error("Vérification échouée : la source n'a pas été ajoutée")
     return False
@@ -412,93 +682,149 @@ def process_chatbot_source(pdf_url):
 # FONCTIONS DE TRACKING (JSON)
 # ============================================
 
-def load_processed_pdfs():
-    """Charge le dictionnaire des PDFs déjà traités avec leur date de traitement"""
-    if os.path.exists(PROCESSED_PDF_LOG):
-        try:
-            with open(PROCESSED_PDF_LOG, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            logging.warning("Fichier processed_pdfs.json corrompu, création d'un nouveau")
-            return {}
-    return {}
+# Caches en mémoire des fichiers de tracking: le JSON n'est lu qu'une seule
+# fois par run, les lectures suivantes sont de simples accès dict
+_processed_cache = None
+_failed_cache = None
 
+# Écriture différée: réécrire tout le JSON à chaque PDF est O(N) par fichier;
+# on coalesce les flushs (toutes les N mutations + flush final garanti)
+_processed_dirty = 0
+_failed_dirty = 0
+TRACKING_FLUSH_EVERY = 10
 
-def save_processed_pdfs(processed):
-    """Sauvegarde le dictionnaire des PDFs traités"""
-    with open(PROCESSED_PDF_LOG, "w", encoding="utf-8") as f:
-        json.dump(processed, f, indent=2, ensure_ascii=False)
 
+def flush_tracking():
+    """Écrit sur disque tout état de tracking encore en mémoire"""
+    global _processed_dirty, _failed_dirty
+    with _tracking_lock:
+        if _processed_dirty and _processed_cache is not None:
+            _atomic_json_dump(_processed_cache, PROCESSED_PDF_LOG)
+            _processed_dirty = 0
+        if _failed_dirty and _failed_cache is not None:
+            _atomic_json_dump(_failed_cache, FAILED_PDF_LOG)
+            _failed_dirty = 0
 
-def save_processed_pdf(url, date):
-    """Enregistre un PDF comme traité avec sa date"""
-    processed = load_processed_pdfs()
-    processed[url] = {
-        "date": date,
-        "processed_at": datetime.now().isoformat(),
-        "filename": get_clean_filename(url)
-    }
-    save_processed_pdfs(processed)
-    logging.info(f"PDF enregistré comme traité : {get_clean_filename(url)}")
 
+atexit.register(flush_tracking)
 
-def remove_processed_pdf(url):
-    """Retire un PDF de la liste des PDFs traités"""
-    processed = load_processed_pdfs()
-    if url in processed:
-        del processed[url]
-        save_processed_pdfs(processed)
-        return True
-    return False
 
+def _atomic_json_dump(data, path):
+    """Écrit un JSON de façon atomique (fichier temporaire + os.replace)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
-def is_pdf_already_processed(url, current_date):
-    """Vérifie si un PDF a déjà été traité avec cette date"""
-    processed = load_processed_pdfs()
-    if url in processed:
-        return processed[url].get("date") == current_date
+
+def load_processed_pdfs():
+    """Charge le dictionnaire des PDFs déjà traités avec leur date de traitement"""
+    global _processed_cache
+    if _processed_cache is not None:
+        return _processed_cache
+
+    _processed_cache = {}
+    try:
+        with open(PROCESSED_PDF_LOG, "r", encoding="utf-8") as f:
+            _processed_cache = json.load(f)
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        logging.warning("Fichier processed_pdfs.json corrompu, création d'un nouveau")
+    return _processed_cache
+
+
+def save_processed_pdfs(processed, force=True):
+    """Sauvegarde le dictionnaire des PDFs traités.
+
+    force=False diffère l'écriture disque (coalescée toutes les
+    TRACKING_FLUSH_EVERY mutations, flush final garanti par atexit)."""
+    global _processed_cache, _processed_dirty
+    _processed_cache = processed
+    _processed_dirty += 1
+    if force or _processed_dirty >= TRACKING_FLUSH_EVERY:
+        _atomic_json_dump(processed, PROCESSED_PDF_LOG)
+        _processed_dirty = 0
+
+
+def save_processed_pdf(url, date, sha256=None, etag=None, length=None):
+    """Enregistre un PDF comme traité avec sa date (plus le hash de son
+    contenu et ses validateurs HTTP pour les courts-circuits)"""
+    with _tracking_lock:
+        processed = load_processed_pdfs()
+        processed[url] = {
+            "date": date,
+            "processed_at": datetime.now().isoformat(),
+            "filename": get_clean_filename(url),
+            "sha256": sha256,
+            "etag": etag,
+            "length": length
+        }
+        save_processed_pdfs(processed, force=False)
+    logging.info(f"PDF enregistré comme traité : {get_clean_filename(url)}")
+
+
+def remove_processed_pdf(url, force=True):
+    """Retire un PDF de la liste des PDFs traités"""
+    with _tracking_lock:
+        processed = load_processed_pdfs()
+        if url in processed:
+            del processed[url]
+            save_processed_pdfs(processed, force=force)
+            return True
     return False
 
 
 def load_failed_pdfs():
     """Charge les PDFs échoués avec leur date d'échec"""
-    if os.path.exists(FAILED_PDF_LOG):
-        try:
-            with open(FAILED_PDF_LOG, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            logging.warning("Fichier failed_pdfs.json corrompu")
-            return {}
-    return {}
+    global _failed_cache
+    if _failed_cache is not None:
+        return _failed_cache
+
+    _failed_cache = {}
+    try:
+        with open(FAILED_PDF_LOG, "r", encoding="utf-8") as f:
+            _failed_cache = json.load(f)
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        logging.warning("Fichier failed_pdfs.json corrompu")
+    return _failed_cache
 
 
-def save_failed_pdfs(failed):
-    """Sauvegarde le dictionnaire des PDFs échoués"""
-    with open(FAILED_PDF_LOG, "w", encoding="utf-8") as f:
-        json.dump(failed, f, indent=2, ensure_ascii=False)
+def save_failed_pdfs(failed, force=True):
+    """Sauvegarde le dictionnaire des PDFs échoués (voir save_processed_pdfs)"""
+    global _failed_cache, _failed_dirty
+    _failed_cache = failed
+    _failed_dirty += 1
+    if force or _failed_dirty >= TRACKING_FLUSH_EVERY:
+        _atomic_json_dump(failed, FAILED_PDF_LOG)
+        _failed_dirty = 0
 
 
 def save_failed_pdf(url, error_msg):
     """Enregistre un PDF échoué"""
-    failed = load_failed_pdfs()
-    retry_count = failed.get(url, {}).get("retry_count", 0) + 1
-    failed[url] = {
-        "error": str(error_msg)[:500],  # Limiter la taille de l'erreur
-        "failed_at": datetime.now().isoformat(),
-        "retry_count": retry_count,
-        "filename": get_clean_filename(url)
-    }
-    save_failed_pdfs(failed)
+    with _tracking_lock:
+        failed = load_failed_pdfs()
+        retry_count = failed.get(url, {}).get("retry_count", 0) + 1
+        failed[url] = {
+            "error": str(error_msg)[:500],  # Limiter la taille de l'erreur
+            "failed_at": datetime.now().isoformat(),
+            "retry_count": retry_count,
+            "filename": get_clean_filename(url)
+        }
+        save_failed_pdfs(failed, force=False)
     logging.info(f"PDF enregistré comme échoué (tentative {retry_count}): {get_clean_filename(url)}")
 
 
 def remove_from_failed(url):
     """Retire un PDF de la liste des échecs après succès"""
-    failed = load_failed_pdfs()
-    if url in failed:
-        del failed[url]
-        save_failed_pdfs(failed)
-        logging.info(f"PDF retiré de la liste des échecs : {get_clean_filename(url)}")
+    with _tracking_lock:
+        failed = load_failed_pdfs()
+        if url in failed:
+            del failed[url]
+            save_failed_pdfs(failed)
+            logging.info(f"PDF retiré de la liste des échecs : {get_clean_filename(url)}")
 
 
 def should_retry_failed_pdf(url, max_retries=3, retry_after_days=7):
@@ -525,43 +851,86 @@ def should_retry_failed_pdf(url, max_retries=3, retry_after_days=7):
 
 def load_removed_pdfs():
     """Charge l'historique des PDFs supprimés"""
-    if os.path.exists(REMOVED_PDF_LOG):
-        try:
-            with open(REMOVED_PDF_LOG, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-    return {}
+    try:
+        with open(REMOVED_PDF_LOG, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_removed_pdfs(cleanup_results):
+    """Enregistre un lot de PDFs supprimés avec le résultat de leur nettoyage"""
+    if not cleanup_results:
+        return
+    removed = load_removed_pdfs()
+    for url, cleanup_result in cleanup_results.items():
+        removed[url] = {
+            "filename": get_clean_filename(url),
+            "removed_at": datetime.now().isoformat(),
+            "cleanup": cleanup_result
+        }
+    _atomic_json_dump(removed, REMOVED_PDF_LOG)
 
 
 def save_removed_pdf(url, cleanup_result):
     """Enregistre un PDF comme supprimé avec le résultat du nettoyage"""
-    removed = load_removed_pdfs()
-    removed[url] = {
-        "filename": get_clean_filename(url),
-        "removed_at": datetime.now().isoformat(),
-        "cleanup": cleanup_result
-    }
-    with open(REMOVED_PDF_LOG, "w", encoding="utf-8") as f:
-        json.dump(removed, f, indent=2, ensure_ascii=False)
+    save_removed_pdfs({url: cleanup_result})
 
 
 # ============================================
 # FONCTIONS SITEMAP
 # ============================================
 
+def load_http_cache():
+    """Charge le cache des en-têtes HTTP (ETag / Last-Modified par URL)"""
+    try:
+        with open(HTTP_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logging.warning("Fichier http_cache.json corrompu, création d'un nouveau")
+        return {}
+
+
+def save_http_cache(cache):
+    """Sauvegarde le cache des en-têtes HTTP"""
+    _atomic_json_dump(cache, HTTP_CACHE_FILE)
+
+
 def download_sitemap():
-    """Télécharge le sitemap depuis l'URL configurée"""
+    """Télécharge le sitemap depuis l'URL configurée (GET conditionnel:
+    si le serveur répond 304, le sitemap local est réutilisé tel quel)"""
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
     }
+
+    cache = load_http_cache()
+    cached = cache.get(SITEMAP_URL, {})
+    # N'envoyer les en-têtes conditionnels que si on a encore le fichier local
+    if os.path.exists(LOCAL_SITEMAP_FILE):
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
     try:
-        response = requests.get(SITEMAP_URL, headers=headers, timeout=HTTP_TIMEOUT)
+        response = SESSION.get(SITEMAP_URL, headers=headers, timeout=HTTP_TIMEOUT)
+        if response.status_code == 304:
+            logging.info("Sitemap inchangé (304 Not Modified), réutilisation du fichier local")
+            with open(LOCAL_SITEMAP_FILE, "rb") as f:
+                return f.read()
         if response.status_code == 200:
-            logging.info(f"Sitemap téléchargé ({len(response.text)} caractères)")
-            return response.text
-        else:
-            logging.error(f"Erreur téléchargement sitemap: HTTP {response.status_code}")
+            cache[SITEMAP_URL] = {
+                "etag": response.headers.get("ETag", ""),
+                "last_modified": response.headers.get("Last-Modified", "")
+            }
+            save_http_cache(cache)
+            # Rester en bytes de bout en bout (parse + sauvegarde):
+            # pas de décodage/réencodage UTF-8 inutile
+            logging.info(f"Sitemap téléchargé ({len(response.content)} octets)")
+            return response.content
+        logging.error(f"Erreur téléchargement sitemap: HTTP {response.status_code}")
     except requests.exceptions.Timeout:
         logging.error("Timeout lors du téléchargement du sitemap")
     except requests.exceptions.RequestException as e:
@@ -570,20 +939,29 @@ def download_sitemap():
 
 
 def parse_sitemap(xml_content):
-    """Parse le contenu XML du sitemap et extrait les PDFs"""
+    """Parse le sitemap en streaming (iterparse) et extrait les PDFs.
+
+    Accepte une chaîne, des bytes ou un objet fichier binaire: les éléments
+    sont libérés au fil de l'eau, la mémoire reste constante quelle que soit
+    la taille du sitemap.
+    """
+    namespace = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+    pdfs = {}
+
+    if isinstance(xml_content, str):
+        source = io.BytesIO(xml_content.encode("utf-8"))
+    elif isinstance(xml_content, bytes):
+        source = io.BytesIO(xml_content)
+    else:
+        source = xml_content
+
     try:
-        root = ET.fromstring(xml_content)
-        namespace = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
-        pdfs = {}
-
-        for url in root.findall(f"{namespace}url"):
-            loc_elem = url.find(f"{namespace}loc")
-            lastmod_elem = url.find(f"{namespace}lastmod")
-            
-            if loc_elem is not None and loc_elem.text:
-                loc = loc_elem.text
-                lastmod = lastmod_elem.text if lastmod_elem is not None else ""
-                pdfs[loc] = lastmod
+        for _, elem in ET.iterparse(source, events=("end",)):
+            if elem.tag == f"{namespace}url":
+                loc = elem.findtext(f"{namespace}loc")
+                if loc:
+                    pdfs[loc] = elem.findtext(f"{namespace}lastmod") or ""
+                elem.clear()
 
         logging.info(f"Sitemap parsé: {len(pdfs)} URLs trouvées")
         return pdfs
@@ -593,10 +971,14 @@ def parse_sitemap(xml_content):
 
 
 def save_sitemap(xml_content):
-    """Sauvegarde le sitemap localement"""
+    """Sauvegarde le sitemap localement (écriture atomique)"""
     try:
-        with open(LOCAL_SITEMAP_FILE, "w", encoding="utf-8") as f:
+        if isinstance(xml_content, str):
+            xml_content = xml_content.encode("utf-8")
+        tmp_path = LOCAL_SITEMAP_FILE + ".tmp"
+        with open(tmp_path, "wb") as f:
             f.write(xml_content)
+        os.replace(tmp_path, LOCAL_SITEMAP_FILE)
         logging.info(f"Sitemap sauvegardé: {LOCAL_SITEMAP_FILE}")
     except Exception as e:
         logging.error(f"Erreur sauvegarde sitemap: {e}")
@@ -609,8 +991,10 @@ def load_local_sitemap():
         return {}
 
     try:
-        with open(LOCAL_SITEMAP_FILE, "r", encoding="utf-8") as f:
-            return parse_sitemap(f.read())
+        # parse_sitemap accepte un fichier binaire: streaming direct,
+        # sans matérialiser le XML en mémoire
+        with open(LOCAL_SITEMAP_FILE, "rb") as f:
+            return parse_sitemap(f)
     except Exception as e:
         logging.error(f"Erreur lecture sitemap local: {e}")
         return {}
@@ -618,10 +1002,14 @@ def load_local_sitemap():
 
 def compare_sitemaps(old_pdfs, new_pdfs):
     """Compare deux sitemaps et retourne les changements"""
-    added = {url: date for url, date in new_pdfs.items() if url not in old_pdfs}
-    changed = {url: date for url, date in new_pdfs.items() if url in old_pdfs and old_pdfs[url] != date}
-    removed = {url: old_pdfs[url] for url in old_pdfs if url not in new_pdfs}
-    
+    # Opérations d'ensembles sur les vues de clés (implémentées en C),
+    # plutôt que trois parcours complets avec tests d'appartenance en Python
+    old_keys = old_pdfs.keys()
+    new_keys = new_pdfs.keys()
+    added = {url: new_pdfs[url] for url in new_keys - old_keys}
+    changed = {url: new_pdfs[url] for url in new_keys & old_keys if old_pdfs[url] != new_pdfs[url]}
+    removed = {url: old_pdfs[url] for url in old_keys - new_keys}
+
     logging.info(f"Comparaison sitemap: {len(added)} ajoutés, {len(changed)} modifiés, {len(removed)} supprimés")
     
     return added, changed, removed
@@ -631,6 +1019,77 @@ def compare_sitemaps(old_pdfs, new_pdfs):
 # GESTION DES PDFS SUPPRIMÉS
 # ============================================
 
+def _cleanup_removed_pdf(url, sources):
+    """Nettoyage complet d'un PDF supprimé (une URL, voir handle_removed_pdfs)"""
+    clean_filename = get_clean_filename(url)
+    md_filename = get_markdown_filename(url)
+
+    logging.info(f"\n🗑️ Nettoyage: {clean_filename}")
+
+    cleanup_result = {
+        "chatbot_source": False,
+        "local_file": False,
+        "ftp_file": False,
+        "tracking": False
+    }
+
+    # 1. Supprimer la source du chatbot (tous les doublons wpdmdl)
+    if sources:
+        wpdmdl_id = extract_wpdmdl(url)
+        matches = find_sources_by_wpdmdl(sources, wpdmdl_id) if wpdmdl_id else []
+        if matches:
+            all_deleted = True
+            for src in matches:
+                if delete_source(src["id"]):
+                    logging.info(f"  ✓ Source chatbot supprimée: {src['id']}")
+                else:
+                    logging.warning(f"  ✗ Échec suppression source chatbot: {src['id']}")
+                    all_deleted = False
+            cleanup_result["chatbot_source"] = all_deleted
+        else:
+            logging.info(f"  ○ Pas de source chatbot trouvée (wpdmdl={wpdmdl_id})")
+            cleanup_result["chatbot_source"] = True  # Pas d'erreur, juste absent
+
+    # 2. Supprimer le fichier markdown local
+    md_path = get_markdown_path(url)
+    if os.path.exists(md_path):
+        try:
+            os.remove(md_path)
+            logging.info(f"  ✓ Fichier local supprimé: {md_path}")
+            cleanup_result["local_file"] = True
+        except Exception as e:
+            logging.warning(f"  ✗ Impossible de supprimer le fichier local: {e}")
+    else:
+        logging.info(f"  ○ Fichier local déjà absent")
+        cleanup_result["local_file"] = True  # Pas d'erreur, juste absent
+
+    # 3. Supprimer le fichier sur FTP
+    if delete_from_ftp(md_filename):
+        logging.info(f"  ✓ Fichier FTP supprimé: {md_filename}")
+        cleanup_result["ftp_file"] = True
+    else:
+        logging.warning(f"  ✗ Échec suppression fichier FTP")
+
+    # 4. Retirer du tracking JSON (processed_pdfs.json) — écriture différée,
+    # le flush unique a lieu après le lot dans handle_removed_pdfs
+    if remove_processed_pdf(url, force=False):
+        logging.info(f"  ✓ Retiré du tracking (processed)")
+        cleanup_result["tracking"] = True
+    else:
+        logging.info(f"  ○ Pas dans le tracking (processed)")
+        cleanup_result["tracking"] = True
+
+    # 5. Retirer aussi de failed_pdfs.json si présent (écriture différée)
+    with _tracking_lock:
+        failed = load_failed_pdfs()
+        if url in failed:
+            del failed[url]
+            save_failed_pdfs(failed, force=False)
+            logging.info(f"  ✓ Retiré du tracking (failed)")
+
+    return cleanup_result
+
+
 def handle_removed_pdfs(removed_urls):
     """
     Gère les PDFs supprimés du sitemap avec nettoyage complet:
@@ -651,91 +1110,44 @@ def handle_removed_pdfs(removed_urls):
     sources = get_sources()
     if sources is None:
         logging.warning("Impossible de récupérer les sources du chatbot - nettoyage partiel")
-    
+
     success_count = 0
     partial_count = 0
-    
-    for url in removed_urls:
-        clean_filename = get_clean_filename(url)
-        md_filename = get_markdown_filename(url)
-        
-        logging.info(f"\n🗑️ Nettoyage: {clean_filename}")
-        
-        cleanup_result = {
-            "chatbot_source": False,
-            "local_file": False,
-            "ftp_file": False,
-            "tracking": False
-        }
-        
-        # 1. Supprimer la source du chatbot (tous les doublons wpdmdl)
-        if sources:
-            wpdmdl_id = extract_wpdmdl(url)
-            matches = find_sources_by_wpdmdl(sources, wpdmdl_id) if wpdmdl_id else []
-            if matches:
-                all_deleted = True
-                for src in matches:
-                    if delete_source(src["id"]):
-                        logging.info(f"  ✓ Source chatbot supprimée: {src['id']}")
-                    else:
-                        logging.warning(f"  ✗ Échec suppression source chatbot: {src['id']}")
-                        all_deleted = False
-                cleanup_result["chatbot_source"] = all_deleted
-            else:
-                logging.info(f"  ○ Pas de source chatbot trouvée (wpdmdl={wpdmdl_id})")
-                cleanup_result["chatbot_source"] = True  # Pas d'erreur, juste absent
-        
-        # 2. Supprimer le fichier markdown local
-        md_path = get_markdown_path(url)
-        if os.path.exists(md_path):
+
+    # Nettoyage en parallèle: chaque worker a sa propre connexion FTP
+    # (thread-local via get_ftp), la liste des sources est partagée en
+    # lecture seule et les écritures de tracking sont sous _tracking_lock
+    cleanup_results = {}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = {executor.submit(_cleanup_removed_pdf, url, sources): url
+                   for url in removed_urls}
+        for future in as_completed(futures):
+            url = futures[future]
             try:
-                os.remove(md_path)
-                logging.info(f"  ✓ Fichier local supprimé: {md_path}")
-                cleanup_result["local_file"] = True
+                cleanup_result = future.result()
             except Exception as e:
-                logging.warning(f"  ✗ Impossible de supprimer le fichier local: {e}")
-        else:
-            logging.info(f"  ○ Fichier local déjà absent")
-            cleanup_result["local_file"] = True  # Pas d'erreur, juste absent
-        
-        # 3. Supprimer le fichier sur FTP
-        if delete_from_ftp(md_filename):
-            logging.info(f"  ✓ Fichier FTP supprimé: {md_filename}")
-            cleanup_result["ftp_file"] = True
-        else:
-            logging.warning(f"  ✗ Échec suppression fichier FTP")
-        
-        # 4. Retirer du tracking JSON (processed_pdfs.json)
-        if remove_processed_pdf(url):
-            logging.info(f"  ✓ Retiré du tracking (processed)")
-            cleanup_result["tracking"] = True
-        else:
-            logging.info(f"  ○ Pas dans le tracking (processed)")
-            cleanup_result["tracking"] = True
-        
-        # 5. Retirer aussi de failed_pdfs.json si présent
-        failed = load_failed_pdfs()
-        if url in failed:
-            del failed[url]
-            save_failed_pdfs(failed)
-            logging.info(f"  ✓ Retiré du tracking (failed)")
-        
-        # 6. Enregistrer dans l'historique des suppressions
-        save_removed_pdf(url, cleanup_result)
-        
-        # Évaluer le résultat
-        all_success = all(cleanup_result.values())
-        any_success = any(cleanup_result.values())
-        
-        if all_success:
-            logging.info(f"  ✅ Nettoyage complet réussi")
-            success_count += 1
-        elif any_success:
-            logging.warning(f"  ⚠️ Nettoyage partiel")
-            partial_count += 1
-        else:
-            logging.error(f"  ❌ Nettoyage échoué")
-    
+                logging.error(f"  ❌ Nettoyage échoué pour {get_clean_filename(url)}: {e}")
+                continue
+            cleanup_results[url] = cleanup_result
+
+            # Évaluer le résultat
+            all_success = all(cleanup_result.values())
+            any_success = any(cleanup_result.values())
+
+            if all_success:
+                logging.info(f"  ✅ Nettoyage complet réussi")
+                success_count += 1
+            elif any_success:
+                logging.warning(f"  ⚠️ Nettoyage partiel")
+                partial_count += 1
+            else:
+                logging.error(f"  ❌ Nettoyage échoué")
+
+    # Un seul flush disque pour tout le lot (au lieu de 3 écritures par URL)
+    save_removed_pdfs(cleanup_results)
+    flush_tracking()
+
+
     logging.info(f"\n{'='*50}")
     logging.info(f"RÉSUMÉ SUPPRESSIONS: {success_count} complets, {partial_count} partiels, {len(removed_urls) - success_count - partial_count} échoués")
     logging.info(f"{'='*50}")
@@ -745,6 +1157,27 @@ def handle_removed_pdfs(removed_urls):
 # FONCTIONS PDF
 # ============================================
 
+def get_remote_pdf_sizes(urls):
+    """Récupère la taille (Content-Length) des PDFs via des requêtes HEAD.
+    Les URLs en erreur ou sans Content-Length sont comptées à 0."""
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+    }
+
+    def head(url):
+        try:
+            response = SESSION.head(url, headers=headers, timeout=10, allow_redirects=True)
+            return url, int(response.headers.get("content-length", 0))
+        except (requests.exceptions.RequestException, ValueError):
+            return url, 0
+
+    sizes = {}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for url, size in executor.map(head, urls):
+            sizes[url] = size
+    return sizes
+
+
 def download_pdf(url):
     """Télécharge un PDF depuis l'URL"""
     clean_filename = get_clean_filename(url)
@@ -755,38 +1188,58 @@ def download_pdf(url):
     }
     
     try:
-        response = requests.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT)
-        
-        if response.status_code == 200:
-            total_size = int(response.headers.get('content-length', 0))
-            
-            with open(filepath, "wb") as f:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded += len(chunk)
-            
-            file_size = os.path.getsize(filepath)
-            logging.info(f"Téléchargé: {clean_filename} ({file_size / 1024:.1f} KB)")
-            
-            # Vérifier que le fichier n'est pas vide
-            if file_size < 100:
-                raise Exception(f"Fichier PDF trop petit ({file_size} bytes), probablement corrompu")
-            
-            return filepath
-        else:
-            raise Exception(f"HTTP {response.status_code}")
-            
+        with SESSION.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+            response.raise_for_status()
+
+            # Boucle de copie en C (1 MiB par bloc) plutôt qu'en Python,
+            # vers un fichier temporaire renommé à la fin: un téléchargement
+            # interrompu ne laisse jamais de PDF tronqué sous le nom final
+            response.raw.decode_content = True
+            tmp_path = filepath + ".part"
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=1 << 20)
+            os.replace(tmp_path, filepath)
+
+            # Validateurs HTTP mémorisés dans le tracking: ils permettent au
+            # prochain run de court-circuiter le téléchargement via un HEAD
+            etag = response.headers.get("ETag", "")
+            length = response.headers.get("content-length", "")
+
+        file_size = os.path.getsize(filepath)
+        logging.info(f"Téléchargé: {clean_filename} ({file_size / 1024:.1f} KB)")
+
+        # Vérifier que le fichier n'est pas vide
+        if file_size < 100:
+            raise Exception(f"Fichier PDF trop petit ({file_size} bytes), probablement corrompu")
+
+        return filepath, etag, length
+
     except requests.exceptions.Timeout:
         raise Exception("Timeout lors du téléchargement")
+    except requests.exceptions.HTTPError as e:
+        raise Exception(f"HTTP {e.response.status_code}")
     except requests.exceptions.RequestException as e:
         raise Exception(f"Erreur réseau: {e}")
 
 
+def _quantize_cpu_models(artifact_dict):
+    """Quantization dynamique int8 des couches Linear pour l'inférence CPU"""
+    quantized = 0
+    for name, model in artifact_dict.items():
+        try:
+            artifact_dict[name] = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            quantized += 1
+        except Exception as e:
+            logging.warning(f"Quantization impossible pour {name}: {e}")
+    logging.info(f"Quantization int8 appliquée à {quantized} modèle(s)")
+
+
 def get_converter():
     """Retourne ou crée le converter PDF (singleton pour réutilisation)"""
     global _converter
-    
+
     if _converter is None:
         logging.info("Initialisation du converter Marker...")
         config = {
@@ -795,50 +1248,121 @@ def get_converter():
             "disable_image_extraction": True,
             "max_tasks_per_worker": 1
         }
-        
+
+        # Tailles de batch Marker (optionnelles): plus de pages par passe
+        # modèle quand la VRAM le permet, meilleure utilisation du GPU
+        for env_var, config_key in (
+            ("MARKER_LAYOUT_BATCH_SIZE", "layout_batch_size"),
+            ("MARKER_DETECTION_BATCH_SIZE", "detection_batch_size"),
+            ("MARKER_RECOGNITION_BATCH_SIZE", "recognition_batch_size"),
+            ("MARKER_TABLE_REC_BATCH_SIZE", "table_rec_batch_size"),
+        ):
+            value = os.getenv(env_var)
+            if value:
+                config[config_key] = int(value)
+                logging.info(f"Config Marker: {config_key}={value}")
+
+        artifact_dict = create_model_dict()
+
+        # Inférence CPU uniquement: borner les threads torch et, en opt-in,
+        # quantizer les modèles en int8 (2-4x plus rapide sur CPU récents)
+        if not torch.cuda.is_available():
+            try:
+                torch.set_num_threads(os.cpu_count() or 1)
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                pass  # déjà configuré par torch
+            if os.getenv("QUANTIZE_CPU", "0") == "1":
+                _quantize_cpu_models(artifact_dict)
+
         config_parser = ConfigParser(config)
         _converter = PdfConverter(
             config=config_parser.generate_config_dict(),
-            artifact_dict=create_model_dict(),
+            artifact_dict=artifact_dict,
             processor_list=config_parser.get_processors(),
             renderer=config_parser.get_renderer()
         )
         logging.info("Converter initialisé")
-    
+
     return _converter
 
 
+def release_models():
+    """Libère explicitement le converter et les modèles Marker (teardown fin de run)"""
+    global _converter
+    if _converter is not None:
+        logging.info("Libération du converter Marker et des modèles")
+        _converter = None
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+# Seuil de détection d'une vraie couche texte (moyenne de caractères par
+# page): en dessous, le PDF est considéré comme scanné et part en OCR
+TEXT_LAYER_MIN_CHARS_PER_PAGE = 200
+
+
+def extract_text_layer(pdf_path):
+    """Extrait le texte d'un PDF via PyMuPDF s'il embarque une couche texte.
+
+    Retourne le texte concaténé, ou None si le PDF semble scanné (ou si
+    PyMuPDF est indisponible) — l'appelant bascule alors sur l'OCR Marker."""
+    if fitz is None:
+        return None
+    try:
+        with fitz.open(pdf_path) as doc:
+            if doc.page_count == 0:
+                return None
+            pages = [page.get_text("text") for page in doc]
+    except Exception as e:
+        logging.warning(f"Analyse PyMuPDF échouée ({e}), bascule sur Marker")
+        return None
+
+    total_chars = sum(len(p.strip()) for p in pages)
+    if total_chars / len(pages) < TEXT_LAYER_MIN_CHARS_PER_PAGE:
+        return None
+    return "\n\n".join(pages)
+
+
 def convert_pdf_to_markdown(pdf_path, source_url):
     """Convertit un PDF en Markdown"""
     clean_filename = get_clean_filename(source_url)
-    md_filename = os.path.join(MARKDOWN_FOLDER, clean_filename.replace(".pdf", ".md"))
-    
+    md_filename = get_markdown_path(source_url)
+
     try:
-        converter = get_converter()
-        rendered = converter(pdf_path)
-        text, _, _ = text_from_rendered(rendered)
-        
+        # Fast-path: si le PDF a déjà une couche texte exploitable, une
+        # extraction native PyMuPDF suffit — pas besoin de payer tout le
+        # pipeline OCR de Marker (de loin le coût dominant par fichier)
+        text = extract_text_layer(pdf_path)
+        if text is not None:
+            logging.info(f"Couche texte détectée, extraction directe sans OCR: {clean_filename}")
+        else:
+            with _convert_lock:
+                converter = get_converter()
+                rendered = converter(pdf_path)
+            text, _, _ = text_from_rendered(rendered)
+
         # Vérifier que la conversion a produit du contenu
         if not text or len(text.strip()) < 50:
             raise Exception("Conversion produit un contenu vide ou trop court")
         
         # Créer le titre propre
-        clean_title = clean_filename.replace("-", " ").replace(".pdf", "")
-        
-        # Écrire le fichier markdown
-        with open(md_filename, "w", encoding="utf-8") as f:
-            f.write(text)
-            f.write(f"\n\n---\n\n**Source :** [{clean_title}]({source_url})")
-        
+        clean_title = get_clean_title(source_url)
+
+        # Construire le payload complet en mémoire puis l'écrire en une
+        # seule passe (atomique: tmp + os.replace). Le même buffer est
+        # renvoyé à l'appelant pour l'upload FTP, sans relecture disque
+        footer = f"\n\n---\n\n**Source :** [{clean_title}]({source_url})"
+        payload = (text + footer).encode("utf-8")
+        tmp_path = md_filename + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, md_filename)
+
         logging.info(f"Converti en Markdown: {clean_filename} ({len(text)} caractères)")
-        
-        # Upload FTP
-        if not upload_to_ftp(md_filename):
-            logging.warning("Upload FTP échoué, mais on continue")
-        
-        # Intégration chatbot
-        process_chatbot_source(source_url)
-        
+        return md_filename, payload
+
     except Exception as e:
         logging.error(f"Erreur conversion {clean_filename}: {e}")
         raise
@@ -846,42 +1370,105 @@ def convert_pdf_to_markdown(pdf_path, source_url):
         cleanup_gpu_memory()
 
 
+def post_process_pdf(url, date, md_filename, pdf_sha=None, md_payload=None,
+                     pdf_etag=None, pdf_length=None):
+    """Étape finale d'un PDF: upload FTP du markdown + source chatbot + tracking"""
+    clean_filename = get_clean_filename(url)
+    try:
+        # Upload FTP (depuis le buffer mémoire si disponible, sans relecture)
+        if not upload_to_ftp(md_filename, data=md_payload):
+            logging.warning("Upload FTP échoué, mais on continue")
+
+        # Intégration chatbot
+        process_chatbot_source(url)
+
+        # Marquer comme traité
+        save_processed_pdf(url, date, pdf_sha, pdf_etag, pdf_length)
+
+        # Retirer de la liste des échecs si présent
+        remove_from_failed(url)
+
+        logging.info(f"✅ SUCCESS: {clean_filename}")
+        return True
+
+    except Exception as e:
+        logging.error(f"❌ FAILED: Erreur post-traitement {clean_filename}: {e}")
+        save_failed_pdf(url, str(e))
+        return False
+
+    finally:
+        _post_slots.release()
+
+
 def process_pdf(url, date):
-    """Traite un PDF complet: téléchargement, conversion, upload"""
+    """Traite un PDF: téléchargement + conversion, puis délègue le
+    post-traitement (FTP + chatbot + tracking) au pool dédié.
+    Retourne le future du post-traitement, True si le PDF était inchangé
+    (conversion court-circuitée), ou None en cas d'échec amont."""
     clean_filename = get_clean_filename(url)
     logging.info(f"{'='*50}")
     logging.info(f"Traitement: {clean_filename}")
     logging.info(f"Date sitemap: {date}")
     logging.info(f"URL: {url}")
-    
+
     pdf_path = None
-    
+
     try:
         # Vérifier la mémoire avant de commencer
         if not check_memory_usage():
             raise Exception("Mémoire insuffisante pour traiter ce PDF")
-        
+
+        previous = load_processed_pdfs().get(url, {})
+
+        # Court-circuit HEAD: si l'ETag et la taille annoncés n'ont pas bougé
+        # depuis le dernier traitement (lastmod re-tamponné sans changement
+        # réel), on s'épargne même le téléchargement
+        if previous.get("etag") and os.path.exists(get_markdown_path(url)):
+            try:
+                head = SESSION.head(url, timeout=10, allow_redirects=True)
+                if (head.ok
+                        and head.headers.get("ETag", "") == previous["etag"]
+                        and head.headers.get("content-length", "") == previous.get("length")):
+                    logging.info(f"PDF inchangé (ETag identique), téléchargement ignoré: {clean_filename}")
+                    save_processed_pdf(url, date, previous.get("sha256"),
+                                       previous["etag"], previous.get("length"))
+                    remove_from_failed(url)
+                    return True
+            except requests.exceptions.RequestException:
+                pass  # HEAD indisponible: on télécharge normalement
+
         # Télécharger le PDF
-        pdf_path = download_pdf(url)
-        
+        pdf_path, pdf_etag, pdf_length = download_pdf(url)
+
+        # Court-circuit: si les octets du PDF n'ont pas changé depuis le
+        # dernier traitement (lastmod purement cosmétique), inutile de
+        # relancer toute la conversion Marker
+        pdf_sha = compute_pdf_hash(pdf_path)
+        if previous.get("sha256") == pdf_sha and os.path.exists(get_markdown_path(url)):
+            logging.info(f"PDF inchangé (SHA-256 identique), conversion ignorée: {clean_filename}")
+            save_processed_pdf(url, date, pdf_sha, pdf_etag, pdf_length)
+            remove_from_failed(url)
+            return True
+
         # Convertir en Markdown
-        convert_pdf_to_markdown(pdf_path, url)
-        
-        # Marquer comme traité
-        save_processed_pdf(url, date)
-        
-        # Retirer de la liste des échecs si présent
-        remove_from_failed(url)
-        
-        logging.info(f"✅ SUCCESS: {clean_filename}")
-        return True
-        
+        md_filename, md_payload = convert_pdf_to_markdown(pdf_path, url)
+
+        # Envoyer upload + chatbot au pool de post-traitement (backpressure
+        # via le sémaphore: on bloque si trop de tâches sont en attente)
+        _post_slots.acquire()
+        try:
+            return _post_pool.submit(post_process_pdf, url, date, md_filename, pdf_sha,
+                                     md_payload, pdf_etag, pdf_length)
+        except Exception:
+            _post_slots.release()
+            raise
+
     except Exception as e:
         error_msg = f"Erreur traitement {clean_filename}: {e}"
         logging.error(f"❌ FAILED: {error_msg}")
         save_failed_pdf(url, str(e))
-        return False
-    
+        return None
+
     finally:
         # Nettoyer le fichier PDF temporaire
         if pdf_path and os.path.exists(pdf_path):
@@ -947,19 +1534,24 @@ def main():
     # ÉTAPE 2: Traiter les nouveaux/modifiés
     # ============================================
     
+    # Charger les trackings une seule fois avant le filtrage (et avant le
+    # pool de workers, pour que les caches soient déjà chauds)
+    processed = load_processed_pdfs()
+    load_failed_pdfs()
+
     # Filtrer les PDFs à traiter
     to_process = {}
-    for url, date in {**added, **changed}.items():
+    for url, date in chain(added.items(), changed.items()):
         # Vérifier si déjà traité avec la même date
-        if is_pdf_already_processed(url, date):
+        if processed.get(url, {}).get("date") == date:
             logging.debug(f"Déjà traité, ignoré: {get_clean_filename(url)}")
             continue
-        
+
         # Vérifier si en échec multiple
         if not should_retry_failed_pdf(url):
             logging.debug(f"Échec multiple, ignoré: {get_clean_filename(url)}")
             continue
-        
+
         to_process[url] = date
     
     total_pdfs = len(to_process)
@@ -972,23 +1564,43 @@ def main():
     else:
         processed_count = 0
         failed_count = 0
-        
-        for idx, (url, date) in enumerate(to_process.items(), 1):
-            logging.info(f"\n[{idx}/{total_pdfs}] Début traitement...")
-            
-            success = process_pdf(url, date)
-            
-            if success:
+
+        # Traitement parallèle: les téléchargements/uploads se recouvrent,
+        # la conversion Marker reste sérialisée via _convert_lock
+        post_futures = []
+
+        # Ordonnancement LPT (plus gros d'abord): évite qu'un PDF de 500
+        # pages arrivant en fin de batch laisse les autres workers oisifs
+        sizes = get_remote_pdf_sizes(to_process.keys())
+        ordered = sorted(to_process.items(), key=lambda item: sizes.get(item[0], 0), reverse=True)
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(process_pdf, url, date): url for url, date in ordered}
+
+            for idx, future in enumerate(as_completed(futures), 1):
+                url = futures[future]
+                try:
+                    post_future = future.result()
+                except Exception as e:
+                    logging.error(f"Erreur inattendue pour {get_clean_filename(url)}: {e}")
+                    post_future = None
+
+                if post_future is None:
+                    failed_count += 1
+                elif post_future is True:
+                    processed_count += 1
+                else:
+                    post_futures.append(post_future)
+
+                logging.info(f"Progression: {idx}/{total_pdfs} convertis ({failed_count} échoués)")
+
+        # Attendre la fin des post-traitements (upload FTP + chatbot)
+        for post_future in post_futures:
+            if post_future.result():
                 processed_count += 1
             else:
                 failed_count += 1
-            
-            logging.info(f"Progression: {processed_count} réussis, {failed_count} échoués sur {idx} traités")
-            
-            # Pause entre les PDFs pour éviter la surcharge
-            if idx < total_pdfs:
-                time.sleep(5)
-        
+
         logging.info(f"\n{'='*50}")
         logging.info(f"RÉSUMÉ TRAITEMENT: {processed_count}/{total_pdfs} PDFs traités avec succès")
         if failed_count > 0:
@@ -996,7 +1608,10 @@ def main():
     
     # Sauvegarder le sitemap
     save_sitemap(new_sitemap_content)
-    
+
+    # Libérer les modèles avant les derniers uploads
+    release_models()
+
     # Stats finales
     end_time = time.time()
     execution_time = end_time - start_time
@@ -1006,14 +1621,10 @@ def main():
     logging.info(f"Temps d'exécution: {execution_time:.2f} secondes ({execution_time/60:.1f} minutes)")
     logging.info(f"{'='*60}")
     
-    # Upload des logs et fichiers de tracking
-    upload_to_ftp("logs.log")
-    if os.path.exists(PROCESSED_PDF_LOG):
-        upload_to_ftp(PROCESSED_PDF_LOG)
-    if os.path.exists(FAILED_PDF_LOG):
-        upload_to_ftp(FAILED_PDF_LOG)
-    if os.path.exists(REMOVED_PDF_LOG):
-        upload_to_ftp(REMOVED_PDF_LOG)
+    # Upload des logs et fichiers de tracking (après flush du différé),
+    # groupé sur une seule connexion FTP
+    flush_tracking()
+    upload_many_to_ftp(["logs.log", PROCESSED_PDF_LOG, FAILED_PDF_LOG, REMOVED_PDF_LOG])
     
     # Suspendre l'instance
     suspendInstance()